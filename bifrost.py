@@ -1,10 +1,12 @@
 import logging
 import os
+import re
 import signal
+import threading
+import time
+from collections import deque
 from dataclasses import dataclass
 from enum import Enum, auto
-from queue import Empty
-from queue import SimpleQueue
 from typing import Optional
 from uuid import uuid4
 
@@ -13,6 +15,13 @@ from paho.mqtt import client
 from paho.mqtt.client import MQTTMessage
 from pixelblaze import Pixelblaze
 
+try:
+    # The C-accelerated loader is around 10x faster, fall back to pure Python where
+    # pyyaml was built without libyaml
+    from yaml import CSafeLoader as _YamlLoader
+except ImportError:
+    from yaml import SafeLoader as _YamlLoader
+
 logging.basicConfig(level=logging.DEBUG,
                     format='%(asctime)s.%(msecs)03d %(levelname)s %(name)-12s : \t%(message)s',
                     datefmt='%H:%M:%S')
@@ -26,14 +35,20 @@ class SignalHandler:
     SIGINT as that's what we use when exiting with CTRL-C etc. Use e.g. 'signals.SIGINT in h.signals'
     as a test to see whether there's been a specific signal received since this object was created.
     There are a few convenience properties to help with this.
+
+    If an event is supplied it's set whenever a watched signal arrives, letting a loop
+    block on the event rather than polling the signal state on a timeout.
     """
 
-    def __init__(self, signals=None):
+    def __init__(self, signals=None, event: threading.Event = None):
         signals_to_watch = signals or [signal.SIGINT]
         self.signals = set()
+        self.event = event
 
         def handler(sig, _frame):
             self.signals.add(sig)
+            if self.event is not None:
+                self.event.set()
 
         for signal_to_watch in signals_to_watch:
             signal.signal(signal_to_watch, handler)
@@ -83,17 +98,23 @@ class MQTTContext:
         self.clean_session = clean_session
         self.protocol = protocol
         self.transport = transport
-        self.host = os.getenv('MQTT_HOST') or host
-        assert host is not None, 'A broker host must be provided'
-        self.port = int(os.getenv('MQTT_PORT') or port)
-        self.keepalive = int(os.getenv('MQTT_KEEPALIVE') or keepalive)
-        self.bind_address = os.getenv('MQTT_BIND_ADDRESS') or bind_address
+        # Resolve each setting once, preferring the environment variable over the
+        # constructor argument and casting env strings to the right type
+        for env_name, attr, cast, value in (('MQTT_HOST', 'host', str, host),
+                                            ('MQTT_PORT', 'port', int, port),
+                                            ('MQTT_KEEPALIVE', 'keepalive', int, keepalive),
+                                            ('MQTT_BIND_ADDRESS', 'bind_address', str, bind_address),
+                                            ('MQTT_USER', 'user', str, user),
+                                            ('MQTT_PASSWORD', 'password', str, password)):
+            env_value = os.getenv(env_name)
+            setattr(self, attr, cast(env_value) if env_value else value)
+        assert self.host is not None, 'A broker host must be provided (via host= or MQTT_HOST)'
         self.client: Optional[client.Client] = None
         self.subscriptions = subscriptions or []
         if not isinstance(self.subscriptions, list):
             self.subscriptions = [self.subscriptions]
-        self.user = os.getenv('MQTT_USER') or user
-        self.password = os.getenv('MQTT_PASSWORD') or password
+        # Paho wants (topic, qos) pairs, build them once rather than on every reconnect
+        self._sub_spec = [(topic, 0) for topic in self.subscriptions]
 
     def __enter__(self) -> client.Client:
         """
@@ -115,7 +136,8 @@ class MQTTContext:
 
         def on_connect(c: client.Client, _userdata, _flags, rc):
             if rc == 0:
-                c.subscribe([(topic, 0) for topic in self.subscriptions])
+                if self._sub_spec:
+                    c.subscribe(self._sub_spec)
             else:
                 LOG.warning(f'Unable to connect to {self.host}, returned code={rc}')
 
@@ -129,20 +151,60 @@ class MQTTContext:
         self.client.loop_stop()
 
 
-def build_message_queue(c: client.Client) -> SimpleQueue:
+class MessageRing:
+    """
+    Bounded single-producer single-consumer handoff between Paho's network thread and the
+    main loop. deque append and popleft are each atomic under the GIL, so with exactly one
+    producer and one consumer no per-message lock is needed, unlike queue.SimpleQueue. The
+    maxlen bound also caps memory by discarding the oldest messages if the consumer stalls.
+    """
+
+    def __init__(self, maxlen: int = 1024, event: threading.Event = None):
+        self._items = deque(maxlen=maxlen)
+        self.event = event or threading.Event()
+
+    def put(self, item):
+        self._items.append(item)
+        self.event.set()
+
+    def wait(self, timeout: float = None) -> bool:
+        """
+        Wait until the producer has signalled new messages, or the timeout expires.
+        Clears the signal so the next wait blocks again once `drain` has caught up.
+        """
+        woke = self.event.wait(timeout=timeout)
+        self.event.clear()
+        return woke
+
+    def drain(self) -> list:
+        """
+        Remove and return everything currently in the ring, oldest first.
+        """
+        items = []
+        while True:
+            try:
+                items.append(self._items.popleft())
+            except IndexError:
+                return items
+
+
+def build_message_queue(c: client.Client, known_switches: frozenset = None,
+                        event: threading.Event = None) -> MessageRing:
     """
-    Simple function to build a message queue, wrapping up button MQTT messages in HueButtonEvent instances
+    Simple function to build a message queue, wrapping up button MQTT messages in HueButtonEvent instances.
+    If a set of known switch names is supplied, messages for other switches are dropped here on the
+    network thread rather than being allocated, queued and inspected by the main loop.
     """
-    queue = SimpleQueue()
+    queue = MessageRing(event=event)
 
     def on_message(_client, _userdata, message):
-        button_message = HueButtonEvent.from_message(m=message)
+        button_message = HueButtonEvent.from_message(m=message, known=known_switches)
         if button_message is not None:
-            queue.put_nowait(button_message)
+            queue.put(button_message)
         else:
-            bifrost_message = BifrostEvent.from_message(m=message)
+            bifrost_message = BifrostEvent.from_message(m=message, known=known_switches)
             if bifrost_message is not None:
-                queue.put_nowait(bifrost_message)
+                queue.put(bifrost_message)
 
     c.on_message = on_message
     return queue
@@ -166,33 +228,51 @@ class PixelBlazeLocator:
 
     def __init__(self):
         self.pb_map: dict[str, Pixelblaze] = {}
+        # Network scans are expensive (UDP broadcast plus a per-device query), so gate them
+        # behind a TTL and remember recent failed lookups for a couple of seconds so a
+        # misconfigured or powered-off pixelblaze doesn't trigger a scan on every button press
+        self._last_enum = 0.0
+        self._enum_ttl = 30.0
+        self._negative: dict[str, float] = {}
+        self._negative_ttl = 2.0
 
     def find_pixelblaze(self, name: str) -> Optional[Pixelblaze]:
         if name in self.pb_map and not (pixelblaze := self.pb_map[name]).connectionBroken:
             return pixelblaze
         else:
             # If we get here and the pixelblaze instance is in the map then we need to tidy up
-            if name in self.pb_map:
+            broken = name in self.pb_map
+            if broken:
                 LOG.debug(f'cleaning up previously closed client {name}')
                 del self.pb_map[name]
+            now = time.monotonic()
+            last_failure = self._negative.get(name)
+            if last_failure is not None and now - last_failure < self._negative_ttl:
+                LOG.debug(f'recent failed lookup for {name}, skipping scan')
+                return None
             # Check whether 'name' is a numeric address
             if parse_ip(name):
                 LOG.debug(f'found valid IP address, bypassing lookup for {name}')
                 self.pb_map[name] = Pixelblaze(ipAddress=name)
-            else:
+            elif broken or now - self._last_enum > self._enum_ttl:
+                # Only scan when a previously cached connection has broken, or when the last
+                # scan has gone stale, otherwise trust the cached enumeration results
                 LOG.debug(f'starting lookup')
                 for pb in Pixelblaze.EnumerateDevices(timeout=1000):
                     pb_name = pb.getDeviceName()
                     LOG.debug(f'lookup - found device with name {pb_name}')
                     if pb_name not in self.pb_map or (pb_name in self.pb_map and self.pb_map[pb_name].connectionBroken):
                         self.pb_map[pb_name] = pb
+                self._last_enum = now
                 LOG.debug(f'lookup completed')
             if name in self.pb_map:
+                self._negative.pop(name, None)
                 pixelblaze = self.pb_map[name]
                 pixelblaze.setSequencerMode(Pixelblaze.sequencerModes.Playlist)
                 pixelblaze.setSequencerState(False)
                 return pixelblaze
             else:
+                self._negative[name] = now
                 return None
 
 
@@ -214,22 +294,37 @@ class HueInteractionType(Enum):
     RELEASE = 3
 
 
-@dataclass
+# Subscription filters are statically known, so match topics with precompiled patterns
+# rather than splitting every incoming topic into a fresh list. Non-matching messages
+# are rejected before the payload is ever decoded.
+_HUE_TOPIC = re.compile(r'hue/([^/]+)/buttonevent')
+_BIFROST_TOPIC = re.compile(r'bifrost/([^/]+)/([^/]+)')
+
+
+@dataclass(slots=True, frozen=True)
 class HueButtonEvent:
     switch: str
     button: int
     interaction: HueInteractionType
 
     @staticmethod
-    def from_message(m: MQTTMessage) -> Optional['HueButtonEvent']:
-        s = m.payload.decode(encoding='UTF8')
-        topic = m.topic.split('/')
-        if len(topic) == 3 and topic[0] == 'hue' and topic[2] == 'buttonevent':
-            event = HueButtonEvent(switch=topic[1],
-                                   button=int(s[0]),
-                                   interaction=HueInteractionType(int(s[3])))
-            LOG.debug(f'found hue bridge event : {event}')
-            return event
+    def from_message(m: MQTTMessage, known: frozenset = None) -> Optional['HueButtonEvent']:
+        match = _HUE_TOPIC.fullmatch(m.topic)
+        if match is None:
+            return None
+        switch = match.group(1)
+        if known is not None and switch not in known:
+            return None
+        payload = m.payload
+        if len(payload) < 4:
+            return None
+        # The payload is a short run of ASCII digits ('1002' etc), so index the bytes
+        # directly rather than decoding to str and parsing single characters
+        event = HueButtonEvent(switch=switch,
+                               button=payload[0] - 48,
+                               interaction=HueInteractionType(payload[3] - 48))
+        LOG.debug(f'found hue bridge event : {event}')
+        return event
 
 
 class BifrostAction(Enum):
@@ -239,19 +334,22 @@ class BifrostAction(Enum):
     OFF = auto()
 
 
-@dataclass
+@dataclass(slots=True, frozen=True)
 class BifrostEvent:
     switch: str
     action: BifrostAction
 
     @staticmethod
-    def from_message(m: MQTTMessage) -> Optional['BifrostEvent']:
-        s = m.payload.decode(encoding='UTF8')
-        topic = m.topic.split('/')
-        if len(topic) == 3 and topic[0] == 'bifrost':
-            event = BifrostEvent(switch=topic[1], action=BifrostAction[topic[2].upper()])
-            LOG.debug(f'found bifrost event : {event}')
-            return event
+    def from_message(m: MQTTMessage, known: frozenset = None) -> Optional['BifrostEvent']:
+        match = _BIFROST_TOPIC.fullmatch(m.topic)
+        if match is None:
+            return None
+        switch = match.group(1)
+        if known is not None and switch not in known:
+            return None
+        event = BifrostEvent(switch=switch, action=BifrostAction[match.group(2).upper()])
+        LOG.debug(f'found bifrost event : {event}')
+        return event
 
 
 @dataclass
@@ -260,30 +358,92 @@ class HueMapping:
     pixelblaze_name: str
     default_brightness: float = 0.1
     _pb: Pixelblaze = None
+    # Last brightness we read from or wrote to the pixelblaze. We're the only writer of
+    # the slider for our mapped device, so this stays valid until the connection drops
+    _cached_brightness: Optional[float] = None
+    # When we last saw the pixelblaze connected, and how long to trust that observation.
+    # The `connected` probe can touch the websocket, so the common path of the hot loop
+    # should be a plain attribute check rather than a health check per event
+    _pb_checked_at: float = 0.0
+    _pb_check_ttl: float = 5.0
 
     @property
     def pb(self) -> Optional[Pixelblaze]:
-        if self._pb is not None and self._pb.connected:
-            return self._pb
+        now = time.monotonic()
+        if self._pb is not None:
+            if now - self._pb_checked_at < self._pb_check_ttl:
+                # Recently seen connected, trust it. A dropped connection is picked up
+                # on the next TTL expiry instead of probing on every lookup
+                return self._pb
+            if self._pb.connected:
+                self._pb_checked_at = now
+                return self._pb
+            self._pb = None
+        self._cached_brightness = None
+        LOG.debug(f'locating pixelblaze for name {self.pixelblaze_name}')
+        self._pb = find_pixelblaze(self.pixelblaze_name)
+        if self._pb is not None:
+            self._pb_checked_at = now
+            LOG.debug(f'found pixelblaze {self._pb} for name {self.pixelblaze_name}')
         else:
-            if self._pb is not None:
-                pass
-            LOG.debug(f'locating pixelblaze for name {self.pixelblaze_name}')
-            self._pb = find_pixelblaze(self.pixelblaze_name)
-            if self._pb is not None:
-                LOG.debug(f'found pixelblaze {self._pb} for name {self.pixelblaze_name}')
-            else:
-                LOG.debug(f'unable to find pixelblaze for name {self.pixelblaze_name}')
-            return self._pb
+            LOG.debug(f'unable to find pixelblaze for name {self.pixelblaze_name}')
+        return self._pb
+
+    def current_brightness(self) -> float:
+        """
+        The brightness slider value, read from the pixelblaze only if we don't already
+        have a cached value. Call after a successful `pb` lookup.
+        """
+        if self._cached_brightness is None:
+            self._cached_brightness = self._pb.getBrightnessSlider()
+        return self._cached_brightness
+
+    def set_brightness(self, brightness: float):
+        """
+        Write the brightness slider and remember what we wrote, so the next event
+        doesn't need a network read. Call after a successful `pb` lookup.
+        """
+        self._pb.setBrightnessSlider(brightness)
+        self._cached_brightness = brightness
 
     def __str__(self):
         return f'hue[{self.switch}]->pb[{self.pixelblaze_name}]'
 
 
-handler = SignalHandler()
+# Hue button events map onto the same four actions used by explicit bifrost topics,
+# which lets the main loop coalesce both kinds. Built once so per-event dispatch is a
+# single dict lookup rather than a chain of button / interaction comparisons.
+# Button 1 is the main 'I' button (cycle patterns, or restore default brightness if
+# currently zero), 2 and 3 brighten / dim on hold or click, 4 is the 'O' off button.
+HUE_ACTIONS: dict[tuple[int, HueInteractionType], BifrostAction] = {
+    (1, HueInteractionType.CLICK): BifrostAction.ON,
+    (2, HueInteractionType.HOLD): BifrostAction.UP,
+    (2, HueInteractionType.CLICK): BifrostAction.UP,
+    (3, HueInteractionType.HOLD): BifrostAction.DOWN,
+    (3, HueInteractionType.CLICK): BifrostAction.DOWN,
+    (4, HueInteractionType.CLICK): BifrostAction.OFF,
+}
+
+
+def action_for(message) -> Optional[BifrostAction]:
+    """
+    Normalise a queued message to the BifrostAction it implies, or None if the message
+    doesn't correspond to an action.
+    """
+    if isinstance(message, BifrostEvent):
+        return message.action
+    if isinstance(message, HueButtonEvent):
+        return HUE_ACTIONS.get((message.button, message.interaction))
+    return None
+
+
+# Shared wakeup, set both by incoming messages and by SIGINT, so the main loop can
+# block indefinitely when idle instead of waking every 100ms to poll the signal state
+wake_event = threading.Event()
+handler = SignalHandler(event=wake_event)
 
 with open('config/bifrost.yml', 'r') as file:
-    config_file = yaml.safe_load(file)
+    config_file = yaml.load(file, Loader=_YamlLoader)
 
 config = [HueMapping(switch=i['hue'],
                      pixelblaze_name=i['pb'],
@@ -292,56 +452,59 @@ config = [HueMapping(switch=i['hue'],
 
 LOG.info(f'retrieved mappings: ' + ', '.join([str(mapping) for mapping in config]))
 
+switch_to_mapping = {entry.switch: entry for entry in config}
+
 with MQTTContext(host=config_file['mqtt']['host'],
                  port=config_file['mqtt']['port'],
                  user=config_file['mqtt']['user'],
                  password=config_file['mqtt']['password'],
                  subscriptions=['hue/+/buttonevent', 'bifrost/+/+']) as client:
-    queue = build_message_queue(client)
-    switch_to_mapping = {entry.switch: entry for entry in config}
+    queue = build_message_queue(client, known_switches=frozenset(switch_to_mapping), event=wake_event)
+    # Hoist the enum members compared against on every action out of the loop, turning
+    # repeated LOAD_ATTR lookups into LOAD_FAST locals
+    ON, UP, DOWN, OFF = BifrostAction.ON, BifrostAction.UP, BifrostAction.DOWN, BifrostAction.OFF
     while not handler.sigint:
-        try:
-            message = queue.get(block=True, timeout=0.1)
-            if isinstance(message, HueButtonEvent):
-                # Regular behaviour, use Hue bridge messages
-                if message.switch in switch_to_mapping:
-                    mapping: HueMapping = switch_to_mapping[message.switch]
-                    pb: Pixelblaze = mapping.pb
-                    if pb is not None:
-                        brightness = pb.getBrightnessSlider()
-                        if message.button == 1 and message.interaction == HueInteractionType.CLICK:
-                            # Main 'I' button, cycle through patterns or restore default brightness
-                            # if currently zero
-                            if brightness == 0:
-                                pb.setBrightnessSlider(mapping.default_brightness)
-                            else:
-                                pb.nextSequencer()
-                        if message.button == 2 and (message.interaction == HueInteractionType.HOLD or
-                                                    message.interaction == HueInteractionType.CLICK):
-                            # Hold or click the bright / dim buttons to increase / decrease brightness
-                            pb.setBrightnessSlider(min(1.0, brightness + 0.1))
-                        if message.button == 3 and (message.interaction == HueInteractionType.HOLD or
-                                                    message.interaction == HueInteractionType.CLICK):
-                            pb.setBrightnessSlider(max(0.1, brightness - 0.1))
-                        if message.button == 4 and message.interaction == HueInteractionType.CLICK:
-                            # Click the 'O' button to set brightness to zero
-                            pb.setBrightnessSlider(0)
-            elif isinstance(message, BifrostEvent):
-                if message.switch in switch_to_mapping:
-                    mapping: HueMapping = switch_to_mapping[message.switch]
-                    pb: Pixelblaze = mapping.pb
-                    if pb is not None:
-                        brightness = pb.getBrightnessSlider()
-                        if message.action == BifrostAction.ON:
-                            if brightness == 0:
-                                pb.setBrightnessSlider(mapping.default_brightness)
-                            else:
-                                pb.nextSequencer()
-                        if message.action == BifrostAction.UP:
-                            pb.setBrightnessSlider(min(1.0, brightness + 0.1))
-                        if message.action == BifrostAction.DOWN:
-                            pb.setBrightnessSlider(max(0.1, brightness - 0.1))
-                        if message.action == BifrostAction.OFF:
-                            pb.setBrightnessSlider(0)
-        except Empty:
-            pass
+        queue.wait()
+        # Drain everything that's arrived, rapid button mashing then collapses to a
+        # single pass over the batch rather than one wait and network round-trip per event
+        batch = queue.drain()
+        if not batch:
+            continue
+        # Group actions by switch, preserving order within each switch. Messages for
+        # unknown switches were already dropped in on_message
+        actions_by_switch: dict[str, list[BifrostAction]] = {}
+        for message in batch:
+            action = action_for(message)
+            if action is not None:
+                actions_by_switch.setdefault(message.switch, []).append(action)
+        for switch, actions in actions_by_switch.items():
+            mapping: HueMapping = switch_to_mapping[switch]
+            pb: Pixelblaze = mapping.pb
+            if pb is None:
+                continue
+            brightness = mapping.current_brightness()
+            # Fold runs of UP / DOWN into a net delta so N held-button events become a
+            # single clamped setBrightnessSlider call, flushing whenever an ON or OFF
+            # interrupts the run
+            delta = 0.0
+            for action in actions:
+                if action == UP:
+                    delta += 0.1
+                elif action == DOWN:
+                    delta -= 0.1
+                else:
+                    if delta != 0.0:
+                        brightness = min(1.0, brightness + delta) if delta > 0 else max(0.1, brightness + delta)
+                        mapping.set_brightness(brightness)
+                        delta = 0.0
+                    if action == ON:
+                        if brightness == 0:
+                            brightness = mapping.default_brightness
+                            mapping.set_brightness(brightness)
+                        else:
+                            pb.nextSequencer()
+                    elif action == OFF:
+                        brightness = 0
+                        mapping.set_brightness(0)
+            if delta != 0.0:
+                mapping.set_brightness(min(1.0, brightness + delta) if delta > 0 else max(0.1, brightness + delta))